@@ -0,0 +1,310 @@
+import sqlite3
+import os
+import json
+import heapq
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+# How much a set counts towards each secondary muscle group of its exercise (the primary muscle group gets 1).
+SECONDARY_MUSCLE_CREDIT = 0.5
+
+BUCKET_TYPES = ("week", "month")
+
+# What each workout contributes to each muscle group. {workouts_filter} is either empty or a WHERE clause on workouts.id.
+WORKOUT_MUSCLE_LOAD_QUERY = """
+INSERT INTO workout_muscle_load (workout_id, muscle_id, week_start, month_start, sets, volume)
+SELECT workout_id, muscle_id, week_start, month_start, SUM(credit), SUM(credit * set_volume)
+FROM (
+    SELECT workouts.id AS workout_id, exercise_templates.primary_muscle_group_id AS muscle_id,
+           date(workouts.start_time, 'weekday 0', '-6 days') AS week_start,
+           date(workouts.start_time, 'start of month') AS month_start,
+           1.0 AS credit, IFNULL(sets.weight, 0) * IFNULL(sets.reps, 0) AS set_volume
+    FROM workouts
+    INNER JOIN exercises ON exercises.workout_id = workouts.id
+    INNER JOIN exercise_templates ON exercise_templates.template_id = exercises.exercise_template_id
+    INNER JOIN sets ON sets.exercise_id = exercises.exercise_id
+    WHERE sets.set_type != 'warmup' {workouts_filter}
+    UNION ALL
+    SELECT workouts.id, secondary_muscle_groups.muscle_id,
+           date(workouts.start_time, 'weekday 0', '-6 days'),
+           date(workouts.start_time, 'start of month'),
+           :secondary_credit, IFNULL(sets.weight, 0) * IFNULL(sets.reps, 0)
+    FROM workouts
+    INNER JOIN exercises ON exercises.workout_id = workouts.id
+    INNER JOIN secondary_muscle_groups ON secondary_muscle_groups.template_id = exercises.exercise_template_id
+    INNER JOIN sets ON sets.exercise_id = exercises.exercise_id
+    WHERE sets.set_type != 'warmup' {workouts_filter}
+)
+GROUP BY workout_id, muscle_id
+"""
+
+
+class MuscleGroupAnalytics:
+    """
+    Weekly and monthly sets and volume per muscle group, kept in the muscle_group_rollups table.
+
+    The rollups are rebuilt from scratch with rebuild(), and kept up to date per synced workout with
+    refresh_workouts() (or on_sync(), which can be subscribed to the AutoSyncDaemon).
+    """
+
+    def __init__(self, database_path="database.db") -> None:
+        if not os.path.isfile(database_path):
+            raise Exception("Database does not exist.")
+        self.database_path = database_path
+        self.conn = sqlite3.connect(database_path)
+        self.cursor = self.conn.cursor()
+
+    def rebuild(self) -> None:
+        """
+        Recompute every workout's contribution and every rollup.
+        """
+        with self.conn:
+            self.cursor.execute("DELETE FROM workout_muscle_load")
+            self.cursor.execute("DELETE FROM muscle_group_rollups")
+            self.cursor.execute(WORKOUT_MUSCLE_LOAD_QUERY.format(workouts_filter=""),
+                                {"secondary_credit": SECONDARY_MUSCLE_CREDIT})
+            for bucket_type in BUCKET_TYPES:
+                self.cursor.execute("INSERT INTO muscle_group_rollups "
+                                    "SELECT muscle_id, ?, " + bucket_type + "_start, SUM(sets), SUM(volume) "
+                                    "FROM workout_muscle_load GROUP BY muscle_id, " + bucket_type + "_start",
+                                    (bucket_type,))
+
+    def refresh_workouts(self, workout_ids) -> None:
+        """
+        Bring the rollups up to date for workouts that were added, updated or deleted.
+        Only the calendar buckets those workouts were in (before and after the change) are recomputed.
+        :param workout_ids: The IDs of the workouts that changed.
+        """
+        affected_buckets = set()
+        with self.conn:
+            for workout_id in workout_ids:
+                # The buckets the workout used to count towards. (It may have moved, if its start time was edited.)
+                for week_start, month_start in self.cursor.execute(
+                        "SELECT week_start, month_start FROM workout_muscle_load WHERE workout_id = ?", (workout_id,)).fetchall():
+                    affected_buckets.add(("week", week_start))
+                    affected_buckets.add(("month", month_start))
+                self.cursor.execute("DELETE FROM workout_muscle_load WHERE workout_id = ?", (workout_id,))
+
+                # Deleted workouts don't have any rows left, so they don't contribute anything new.
+                self.cursor.execute(WORKOUT_MUSCLE_LOAD_QUERY.format(workouts_filter="AND workouts.id = :workout_id"),
+                                    {"secondary_credit": SECONDARY_MUSCLE_CREDIT, "workout_id": workout_id})
+                for week_start, month_start in self.cursor.execute(
+                        "SELECT week_start, month_start FROM workout_muscle_load WHERE workout_id = ?", (workout_id,)).fetchall():
+                    affected_buckets.add(("week", week_start))
+                    affected_buckets.add(("month", month_start))
+
+            for bucket_type, bucket_start in affected_buckets:
+                self.cursor.execute("DELETE FROM muscle_group_rollups WHERE bucket_type = ? AND bucket_start = ?",
+                                    (bucket_type, bucket_start))
+                self.cursor.execute("INSERT INTO muscle_group_rollups "
+                                    "SELECT muscle_id, ?, ?, SUM(sets), SUM(volume) FROM workout_muscle_load "
+                                    "WHERE " + bucket_type + "_start = ? GROUP BY muscle_id",
+                                    (bucket_type, bucket_start, bucket_start))
+
+    def on_sync(self, changes) -> None:
+        """
+        AutoSyncDaemon subscriber: refresh the rollups for every workout in the changes.
+        """
+        self.refresh_workouts(changes["added"] + changes["updated"] + changes["deleted"])
+
+    def get_muscle_id(self, muscle_name):
+        """
+        Get the ID of a muscle group by its name. Hevy stores names like "lower_back", but "Lower Back" works too.
+        :return: The muscle group ID, or None if there isn't one with this name.
+        """
+        muscle_name = muscle_name.strip().lower().replace(" ", "_")
+        result = self.cursor.execute("SELECT muscle_id FROM muscle_groups WHERE muscle_name = ?", (muscle_name,)).fetchone()
+        return result[0] if result is not None else None
+
+    def get_bucket_start(self, date, bucket_type="week") -> str:
+        """
+        Get the first day of the week (Monday) or month that the given date falls in.
+        :param date: A datetime.
+        :return: The date in YYYY-MM-DD format.
+        """
+        if bucket_type == "week":
+            return (date - timedelta(days=date.weekday())).strftime("%Y-%m-%d")
+        elif bucket_type == "month":
+            return date.strftime("%Y-%m-01")
+        raise Exception("Bucket type must be either 'week' or 'month'.")
+
+    def get_muscle_group_load(self, muscle_name, periods=12, bucket_type="week", now=None) -> list:
+        """
+        Get the sets and volume for a muscle group over the last few weeks or months (including the current one).
+        Buckets where the muscle group wasn't trained are left out.
+        :param muscle_name: The name of the muscle group, e.g. "lats".
+        :param periods: How many weeks or months to look back.
+        :param bucket_type: Either "week" or "month".
+        :param now: The current time (for testing), defaults to now in UTC.
+        :return: A list of (bucket start, sets, volume in kg) tuples, oldest first.
+        """
+        if now is None:
+            now = datetime.now(timezone.utc)
+
+        muscle_id = self.get_muscle_id(muscle_name)
+        if muscle_id is None:
+            raise Exception("Muscle group " + muscle_name + " not found.")
+
+        if bucket_type == "week":
+            first_bucket = self.get_bucket_start(now - timedelta(weeks=periods - 1), "week")
+        elif bucket_type == "month":
+            # Step back one month at a time from the start of the current month.
+            year, month = now.year, now.month - (periods - 1)
+            while month < 1:
+                year, month = year - 1, month + 12
+            first_bucket = "%04d-%02d-01" % (year, month)
+        else:
+            raise Exception("Bucket type must be either 'week' or 'month'.")
+
+        # Workouts dated in the future (e.g. a wrong clock) land in later buckets, which aren't part of "the last few periods".
+        last_bucket = self.get_bucket_start(now, bucket_type)
+
+        results = self.cursor.execute("SELECT bucket_start, sets, volume FROM muscle_group_rollups "
+                                      "WHERE muscle_id = ? AND bucket_type = ? AND bucket_start >= ? AND bucket_start <= ? "
+                                      "ORDER BY bucket_start", (muscle_id, bucket_type, first_bucket, last_bucket))
+        return results.fetchall()
+
+
+def connect_read_only(database_path, immutable=True) -> sqlite3.Connection:
+    """
+    Open a read-only connection to the database, for the analytics workers.
+    With immutable, SQLite skips locking and change detection entirely, so the database must not be written to
+    while the connection is open (the AnalyticsExecutor only writes after every worker is done).
+    """
+    uri = Path(database_path).resolve().as_uri() + "?mode=ro"
+    if immutable:
+        uri += "&immutable=1"
+    return sqlite3.connect(uri, uri=True)
+
+
+def compute_template_stats(database_path, template_ids, immutable=True) -> list:
+    """
+    Worker job: the sessions, PRs and volume trend of each exercise template, read from exercise_history.
+    :param database_path: The path to the database (opened read-only).
+    :param template_ids: The exercise template IDs to compute.
+    :return: A list of exercise_template_stats rows.
+    """
+    conn = connect_read_only(database_path, immutable)
+    computed_on = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    rows = []
+
+    for template_id in template_ids:
+        sessions = 0
+        best_weight = best_e1rm = best_set_volume = None
+        # (days since the epoch, session volume) points for the regression.
+        points = []
+
+        # exercise_history has a row per exercise entry, so entries with the same start time are one session.
+        previous_start_time = None
+        for start_time, sets in conn.execute("SELECT start_time, sets FROM exercise_history "
+                                             "WHERE exercise_template_id = ? ORDER BY start_time", (template_id,)):
+            if start_time != previous_start_time:
+                sessions += 1
+                day = datetime.fromisoformat(start_time.replace("Z", "+00:00")).timestamp() / 86400
+                points.append((day, 0.0))
+                previous_start_time = start_time
+            session_volume = 0.0
+            for set_index, set_type, weight, reps, distance, duration, rpe in json.loads(sets):
+                if set_type == "warmup" or weight is None:
+                    continue
+                best_weight = weight if best_weight is None else max(best_weight, weight)
+                if reps:
+                    e1rm = weight * (1 + reps / 30)
+                    best_e1rm = e1rm if best_e1rm is None else max(best_e1rm, e1rm)
+                    best_set_volume = weight * reps if best_set_volume is None else max(best_set_volume, weight * reps)
+                    session_volume += weight * reps
+            points[-1] = (points[-1][0], points[-1][1] + session_volume)
+
+        rows.append((template_id, sessions, best_weight, best_e1rm, best_set_volume, get_slope(points), computed_on))
+
+    conn.close()
+    return rows
+
+
+def get_slope(points):
+    """
+    Least squares slope of (day, value) points, per week.
+    :return: The slope, or None if there aren't at least two different days.
+    """
+    if len(points) < 2:
+        return None
+    mean_x = sum(x for x, y in points) / len(points)
+    mean_y = sum(y for x, y in points) / len(points)
+    variance = sum((x - mean_x) ** 2 for x, y in points)
+    if variance == 0:
+        return None
+    covariance = sum((x - mean_x) * (y - mean_y) for x, y in points)
+    return covariance / variance * 7
+
+
+class AnalyticsExecutor:
+    """
+    Runs per exercise template analytics jobs in a process pool.
+
+    The templates are split into partitions of roughly equal work (by number of sessions), each worker reads
+    its partition through its own read-only connection, and the results are written to the result table
+    in a single transaction once every worker is done.
+
+    A job is a module-level function (so it can be sent to the workers) that takes the database path and a list of
+    template IDs and returns rows for the result table, with the template ID first. See compute_template_stats.
+    """
+
+    def __init__(self, database_path="database.db", workers=None) -> None:
+        if not os.path.isfile(database_path):
+            raise Exception("Database does not exist.")
+        self.database_path = database_path
+        self.workers = workers if workers is not None else (os.cpu_count() or 1)
+
+    def partition(self, template_ids, partitions) -> list:
+        """
+        Split the templates into partitions with about the same number of sessions each (largest first, into the lightest partition).
+        :param template_ids: The exercise template IDs, or None for every template with any history.
+        :param partitions: How many partitions to make.
+        :return: A list of non-empty lists of template IDs.
+        """
+        conn = connect_read_only(self.database_path, immutable=False)
+        if template_ids is None:
+            sizes = conn.execute("SELECT exercise_template_id, COUNT(*) FROM exercise_history GROUP BY exercise_template_id").fetchall()
+        else:
+            sizes = [(template_id, conn.execute("SELECT COUNT(*) FROM exercise_history WHERE exercise_template_id = ?",
+                                                (template_id,)).fetchone()[0]) for template_id in template_ids]
+        conn.close()
+
+        heap = [(0, index, []) for index in range(max(1, partitions))]
+        for template_id, size in sorted(sizes, key=lambda item: item[1], reverse=True):
+            load, index, members = heapq.heappop(heap)
+            members.append(template_id)
+            heapq.heappush(heap, (load + size, index, members))
+        return [members for load, index, members in heap if members]
+
+    def run(self, job, result_table, template_ids=None) -> int:
+        """
+        Run a job over the templates and store the results.
+        :param job: The job function, e.g. compute_template_stats.
+        :param result_table: The table to write the results to, e.g. "exercise_template_stats".
+        :param template_ids: The templates to recompute, or None to recompute every template (replacing the whole table).
+        :return: The number of rows written.
+        """
+        # A few partitions per worker, so a slow partition doesn't leave the other workers idle.
+        partitions = self.partition(template_ids, self.workers * 4)
+
+        rows = []
+        if self.workers == 1:
+            for template_partition in partitions:
+                rows.extend(job(self.database_path, template_partition))
+        else:
+            with ProcessPoolExecutor(max_workers=self.workers) as pool:
+                for partition_rows in pool.map(job, [self.database_path] * len(partitions), partitions):
+                    rows.extend(partition_rows)
+
+        conn = sqlite3.connect(self.database_path)
+        with conn:
+            if template_ids is None:
+                conn.execute("DELETE FROM " + result_table)
+            else:
+                conn.executemany("DELETE FROM " + result_table + " WHERE template_id = ?", [(template_id,) for template_id in template_ids])
+            if rows:
+                conn.executemany("INSERT INTO " + result_table + " VALUES (" + ",".join("?" * len(rows[0])) + ")", rows)
+        conn.close()
+        return len(rows)
@@ -0,0 +1,147 @@
+import asyncio
+import logging
+from datetime import datetime, timezone
+
+
+class AutoSyncDaemon:
+    """
+    Keeps the local database fresh by polling the Hevy workouts/events endpoint in the background.
+
+    The polling interval adapts to activity: it starts at min_interval, doubles (by backoff_factor) every
+    time nothing changes, up to max_interval, and drops back to min_interval when changes come in or
+    when the latest workout ended less than active_window seconds ago (that's when edits usually happen).
+
+    Changes are applied through NotAnotherPullupMain.sync_recent_workout_changes, then published to every
+    subscribed callback as a dictionary of workout IDs: {"added": [...], "updated": [...], "deleted": [...]}.
+    """
+
+    def __init__(self, client, min_interval=30, max_interval=900, backoff_factor=2, active_window=1800) -> None:
+        try:
+            assert 0 < min_interval <= max_interval
+            assert backoff_factor >= 1
+        except AssertionError:
+            raise Exception("Invalid polling intervals. Make sure 0 < min_interval <= max_interval and backoff_factor >= 1.")
+        self.client = client
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff_factor = backoff_factor
+        self.active_window = active_window
+        self.interval = min_interval
+        # The time of the last successful poll. None means "since the latest added_on in the database".
+        self.since = None
+        self.subscribers = []
+
+    def subscribe(self, callback):
+        """
+        Register a callback to be called with the changes after every sync that changed something.
+        The callback can be a regular function or a coroutine function.
+        :param callback: A callable that takes the changes dictionary.
+        :return: The callback, so this can be used as a decorator.
+        """
+        self.subscribers.append(callback)
+        return callback
+
+    def unsubscribe(self, callback) -> None:
+        """
+        Remove a previously registered callback.
+        """
+        if callback in self.subscribers:
+            self.subscribers.remove(callback)
+
+    async def publish(self, changes) -> None:
+        """
+        Notify every subscriber of the changes. A failing subscriber does not stop the others.
+        """
+        for callback in list(self.subscribers):
+            try:
+                result = callback(changes)
+                if asyncio.iscoroutine(result):
+                    await result
+            except Exception:
+                logging.exception("Auto-sync subscriber " + repr(callback) + " failed.")
+
+    def poll(self) -> dict:
+        """
+        Fetch the workout events since the last poll and apply them to the local database. (Blocking.)
+        :return: The workout IDs that were added, updated and deleted.
+        """
+        poll_started = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+        changes = self.client.sync_recent_workout_changes(since=self.since)
+        self.since = poll_started
+        return changes
+
+    def get_latest_workout_end(self):
+        """
+        Get the end time of the most recent workout in the database.
+        :return: A timezone-aware datetime, or None if there are no workouts.
+        """
+        conn = self.client.connect_database()
+        cursor = conn.cursor()
+        cursor.execute("SELECT MAX(end_time) FROM workouts")
+        latest = cursor.fetchone()[0]
+        cursor.close()
+        conn.close()
+
+        if latest is None:
+            return None
+        latest = datetime.fromisoformat(latest.replace("Z","+00:00"))
+        if latest.tzinfo is None:
+            latest = latest.replace(tzinfo=timezone.utc)
+        return latest
+
+    def next_interval(self, changes, latest_workout_end=None, now=None) -> float:
+        """
+        Work out how long to wait before the next poll.
+        :param changes: The changes from the last poll.
+        :param latest_workout_end: The end time of the most recent workout, if known.
+        :param now: The current time (for testing), defaults to now in UTC.
+        :return: The number of seconds to wait.
+        """
+        if now is None:
+            now = datetime.now(timezone.utc)
+
+        changed = any(len(workout_ids) > 0 for workout_ids in changes.values())
+        recently_ended = latest_workout_end is not None and (now - latest_workout_end).total_seconds() < self.active_window
+
+        if changed or recently_ended:
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.interval * self.backoff_factor, self.max_interval)
+        return self.interval
+
+    async def sync_once(self) -> dict:
+        """
+        Run one poll in a worker thread (so the event loop isn't blocked by the HTTP calls) and publish the changes.
+        :return: The changes from this poll.
+        """
+        changes = await asyncio.to_thread(self.poll)
+        if any(len(workout_ids) > 0 for workout_ids in changes.values()):
+            await self.publish(changes)
+        return changes
+
+    async def run(self, stop_event=None) -> None:
+        """
+        Poll until stop_event is set (or forever, if it isn't given).
+        Errors during a poll (e.g. the API being unreachable) are logged and treated as "no changes", so they back off too.
+        :param stop_event: An asyncio.Event used to stop the loop.
+        """
+        if stop_event is None:
+            stop_event = asyncio.Event()
+
+        while not stop_event.is_set():
+            try:
+                changes = await self.sync_once()
+                latest_workout_end = await asyncio.to_thread(self.get_latest_workout_end)
+            except Exception as e:
+                # This happens on every poll while the API is down, so keep it to one line (the traceback is for debugging).
+                logging.warning("Auto-sync poll failed: " + repr(e))
+                logging.debug("Auto-sync poll failure details:", exc_info=True)
+                changes = {"added":[],"updated":[],"deleted":[]}
+                latest_workout_end = None
+
+            interval = self.next_interval(changes, latest_workout_end)
+            logging.debug("Next auto-sync poll in " + str(interval) + " seconds.")
+            try:
+                await asyncio.wait_for(stop_event.wait(), timeout=interval)
+            except asyncio.TimeoutError:
+                pass
@@ -1,8 +1,11 @@
-import requests,json
+import json
 import sqlite3
 import os, sys
+import threading
 from shutil import copy
 from datetime import datetime, timezone
+from collections import OrderedDict
+from streaming import iter_workout_records, iter_json_items, iter_file_chunks, to_workout_record, CHUNK_SIZE, SetRecord
 import logging
 
 class NotAnotherPullupMain:
@@ -47,6 +50,21 @@ class NotAnotherPullupMain:
         
         conn.commit()
 
+    def upgrade_database(self) -> None:
+        """
+        Add any tables or indexes from the schema.sql file that an existing database doesn't have yet.
+        (Every statement in the schema is "IF NOT EXISTS", so the existing data is left alone.)
+        """
+        
+        conn = self.connect_database()
+        try:
+            with open('../schema.sql','r') as file:
+                conn.executescript(file.read())
+        except FileNotFoundError:
+            raise Exception("schema.sql file not found.")
+        finally:
+            conn.close()
+
     def backup_database(self) -> None:
         """
         Backup the database.
@@ -70,26 +88,26 @@ class NotAnotherPullupMain:
             raise Exception("Database does not exist. Please run the initialize_database function.")
         return sqlite3.connect("database.db")
 
-    def get_all_initial_workouts(self,api_endpoint="https://api.hevyapp.com/v1/") -> list:
+    def iter_all_workouts(self,api_endpoint="https://api.hevyapp.com/v1/"):
         """
-        Compile all the Hevy workouts from the API into a Python list (of dictionaries).
-        :return: A list of all the workouts.
+        Stream all the Hevy workouts from the API, one at a time.
+        Each page is parsed as it is downloaded, so only one workout is held in memory as a dictionary at a time.
+        :return: A generator of WorkoutRecords.
         """
         
-        # TODO: Save the data as a JSON, so I don't have to keep calling the API.
+        # requests is only imported when we actually talk to the API, to keep startup fast.
+        import requests
         
         current_page_number = 1
         page_count = -1
-        final_list = []
         while current_page_number <= page_count or page_count == -1:
             # Use the api_endpoint, iterating through each page of the workouts with the maximum page size of 10.
-            response = requests.get(api_endpoint + "workouts?page=" + str(current_page_number) + "&pageSize=10",headers={"api-key":self.api_key})
-            current_page_dict = response.json()
+            response = requests.get(api_endpoint + "workouts?page=" + str(current_page_number) + "&pageSize=10",headers={"api-key":self.api_key},stream=True)
+            page_fields = {}
+            yield from iter_workout_records(response.iter_content(CHUNK_SIZE), page_fields)
+            response.close()
             if page_count == -1:
-                page_count = current_page_dict["page_count"]
-    
-            for workout in current_page_dict["workouts"]:
-                final_list.append(workout)
+                page_count = page_fields["page_count"]
             
             percent = round((current_page_number/page_count)*100, 2)
             print("Progress " + str(percent) + "%.")
@@ -97,14 +115,23 @@ class NotAnotherPullupMain:
             current_page_number += 1
 
         print("Finished compiling all workouts.")
-            
-        return final_list
+
+    def get_all_initial_workouts(self,api_endpoint="https://api.hevyapp.com/v1/") -> list:
+        """
+        Compile all the Hevy workouts from the API into a Python list (of WorkoutRecords).
+        Prefer iter_all_workouts, which doesn't hold every workout in memory.
+        :return: A list of all the workouts.
+        """
+        return list(self.iter_all_workouts(api_endpoint))
 
     def get_exercise_templates(self,api_endpoint="https://api.hevyapp.com/v1/") -> list:
         """
         Get all the exercise templates from the Hevy API.
         """
         
+        # requests is only imported when we actually talk to the API, to keep startup fast.
+        import requests
+        
         # TODO: Make function that reuses the process of getting all JSON data from the API, then replace all instances of this process with the new function.
         
         # TODO: Add exercise_templates table to the database schema.
@@ -161,65 +188,19 @@ class NotAnotherPullupMain:
         
         conn = self.connect_database()
         
-        workouts = self.get_all_initial_workouts()
-        
-        exercise_id = 1
-        set_id = 1
+        cursor = conn.cursor()
         
         print("Populating database with workouts...")
         added_on = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
         
-        for workout in workouts:
-            cursor = conn.cursor()
-            
-            workout_id = workout["id"]
-            title = workout["title"]
-            description = workout["description"]
-            start_time = workout["start_time"]
-            end_time = workout["end_time"]
-            updated_at = workout["updated_at"]
-            created_at = workout["created_at"]
-            
+        workout_number = 0
+        for workout in self.iter_all_workouts():
+            self.insert_workout_rows(cursor, workout, added_on)
             
-            cursor.execute("INSERT INTO workouts "
-                        "VALUES (?,?,?,?,?,?,?,?)",
-                        (workout_id,title,description,start_time,end_time,updated_at,created_at,added_on))
-            conn.commit()
-            
-            for exercise in workout["exercises"]:
-                exercise_index = exercise["index"]
-                exercise_title = exercise["title"]
-                exercise_notes = exercise["notes"]
-                exercise_template_id = exercise["exercise_template_id"]
-                cursor.execute("INSERT INTO exercises "
-                            "VALUES (?,?,?,?,?,?)",
-                            (workout_id,exercise_id,exercise_index,exercise_title,exercise_notes,exercise_template_id))
-                
-                conn.commit()
-                
-                for set in exercise["sets"]:
-                    set_index = set["index"]
-                    set_type = set["type"]
-                    weight = set["weight_kg"]
-                    reps = set["reps"]
-                    distance = set["distance_meters"]
-                    duration = set["duration_seconds"]
-                    rpe = set["rpe"]
-                    
-                    cursor.execute("INSERT INTO sets "
-                                "VALUES (?,?,?,?,?,?,?,?,?)",
-                                (exercise_id,set_id,set_index,set_type,weight,reps,distance,duration,rpe))
-                    
-                    conn.commit()
-                    
-                    set_id += 1
-                    
-                if exercise_id % 20:
-                    print("Finished adding workout " + workout_id + " to the database.")
-                exercise_id += 1
-            if exercise_id % 20:
-                print("Finished adding workout " + workout_id + " to the database.")
-                
+            workout_number += 1
+            if workout_number % 20 == 0:
+                print("Finished adding workout " + workout.id + " to the database.")
+        conn.commit()
  
         print("Finished adding all workouts to the database.")
         print("Adding exercise templates to the database...")
@@ -313,66 +294,190 @@ class NotAnotherPullupMain:
         
         return cursor.fetchone()[0]
 
-    def get_recent_workout_changes(self, api_endpoint="https://api.hevyapp.com/v1/") -> list:
+    def iter_recent_workout_changes(self, api_endpoint="https://api.hevyapp.com/v1/", since=None):
         """
-        Use the Hevy API events endpoint to get a list of workout updates since the last update.
+        Use the Hevy API events endpoint to stream the workout updates since the last update, one page at a time.
+        :param since: ISO8601 timestamp to look for events after. Defaults to the latest added_on in the database.
+        :return: A generator of {"updated": [...], "deleted": [...]} dictionaries (one per page) for apply_workout_changes.
         """
         
-        updates = {"added":[],"updated":[],"deleted":[]}
+        import requests
+        
         current_page = 1
         page_count = -1
         
-        date_since = self.get_latest_added_workout_date()
+        date_since = since if since is not None else self.get_latest_added_workout_date()
         # Make it URL-safe.
         date_since = date_since.replace(":","%3A") 
                 
                     
         while current_page <= page_count or page_count == -1:
-            response = requests.get(api_endpoint + "workouts/events?page" + str(current_page) + "&pageSize=10&since=" + date_since,headers={"api-key":self.api_key})
-            current_page_dict = response.json()
-            if page_count == -1:
-                page_count = current_page_dict["page_count"]
-                
-            if "events" not in current_page_dict.keys():
+            response = requests.get(api_endpoint + "workouts/events?page=" + str(current_page) + "&pageSize=10&since=" + date_since,headers={"api-key":self.api_key},stream=True)
+            updates = {"updated":[],"deleted":[]}
+            page_fields = {}
+            event_count = 0
+            for event in iter_json_items(response.iter_content(CHUNK_SIZE), "events", page_fields):
+                event_count += 1
+                try:
+                    if event["type"] == "updated":
+                        updates["updated"].append(to_workout_record(event["workout"]))
+                    elif event["type"] == "deleted":
+                        # apply_workout_changes only needs the ID, so read it here where a missing one can be skipped.
+                        updates["deleted"].append({"id": event["id"]})
+                except KeyError as e:
+                    # Skip the event, but keep the rest of the batch.
+                    print("Data is missing from a workout event (" + str(e) + "). It was skipped.")
+                    logging.debug("Skipped workout event: " + repr(event))
+            response.close()
+            
+            if event_count == 0:
                 break
-           
-            for event in current_page_dict["events"]:
-                if event["type"] == "updated":
-                    updates["updated"].append(event)
-                elif event["type"] == "deleted":
-                    updates["deleted"].append(event)
+            if page_count == -1:
+                page_count = page_fields["page_count"]
             
+            yield updates
             current_page += 1
-        return updates
     
-    def update_database(self) -> None:
-        updates = self.get_recent_workout_changes()
+    def sync_recent_workout_changes(self, since=None) -> dict:
+        """
+        Apply the workout events since the last update to the local database, page by page as they are downloaded,
+        so a long time between syncs doesn't mean holding every changed workout in memory at once.
+        :param since: ISO8601 timestamp to look for events after. Defaults to the latest added_on in the database.
+        :return: The workout IDs that were added, updated and deleted.
+        """
+        
+        changes = {"added":[],"updated":[],"deleted":[]}
+        for updates in self.iter_recent_workout_changes(since=since):
+            page_changes = self.apply_workout_changes(updates)
+            for change_type in changes:
+                changes[change_type] += page_changes[change_type]
+        return changes
+    
+    def update_database(self) -> dict:
+        """
+        Apply the workout changes since the last update to the local database.
+        :return: The workout IDs that were added, updated and deleted.
+        """
+        changes = self.sync_recent_workout_changes()
         
-        if len(updates["updated"]) + len(updates["deleted"]) == 0:
+        if len(changes["added"]) + len(changes["updated"]) + len(changes["deleted"]) == 0:
             print("No updates found.")
         else:
-            for event in updates["updated"]:
-                conn = self.connect_database()
-                cursor = conn.cursor()
-                cursor.execute("SELECT * FROM workouts WHERE id = ?",(event["workout"]["id"],))
-                exists = cursor.fetchall()
-                cursor.close()
-                conn.close()
-                if exists == []:
-                    self.add_workout_locally(event["workout"])
-                else:
-                    self.update_workout_locally(event["workout"]["id"],event["workout"])
-                
-            for event in updates["deleted"]:
-                self.delete_workout_locally(event["id"])
             print("Finished updating the database.")
+        return changes
+    
+    def apply_workout_changes(self, updates) -> dict:
+        """
+        Apply a batch of workout events (a page from iter_recent_workout_changes) to the local database.
+        :param updates: A dictionary with "updated" (WorkoutRecords) and "deleted" (event) lists.
+        :return: A dictionary of the workout IDs that were actually "added", "updated" and "deleted".
+        """
+        
+        changes = {"added":[],"updated":[],"deleted":[]}
+        for workout in updates["updated"]:
+            conn = self.connect_database()
+            cursor = conn.cursor()
+            cursor.execute("SELECT * FROM workouts WHERE id = ?",(workout.id,))
+            exists = cursor.fetchall()
+            cursor.close()
+            conn.close()
+            if exists == []:
+                if self.add_workout_locally(workout):
+                    changes["added"].append(workout.id)
+            else:
+                if self.update_workout_locally(workout.id,workout):
+                    changes["updated"].append(workout.id)
+            
+        for event in updates["deleted"]:
+            if self.delete_workout_locally(event["id"]):
+                changes["deleted"].append(event["id"])
+        return changes
+    
+    def insert_workout_rows(self, cursor, workout, added_on) -> None:
+        """
+        Insert a workout along with its exercises and sets. Does not commit.
+        :param cursor: The cursor to insert with.
+        :param workout: A WorkoutRecord (see streaming.py).
+        :param added_on: The ISO8601 timestamp to record as the time the workout was added.
+        """
+        
+        cursor.execute("INSERT INTO workouts "
+                       "VALUES (?,?,?,?,?,?,?,?)",
+                       workout[:7] + (added_on,))
+        
+        for exercise in workout.exercises:
+            # Leaving exercise_id as NULL lets SQLite pick the next rowid.
+            cursor.execute("INSERT INTO exercises "
+                           "VALUES (?,?,?,?,?,?)",
+                           (workout.id,None) + exercise[:4])
+            exercise_id = cursor.lastrowid
+            
+            cursor.executemany("INSERT INTO sets "
+                               "VALUES (?,?,?,?,?,?,?,?,?)",
+                               [(exercise_id,None) + set for set in exercise.sets])
             
+            if exercise.exercise_template_id is not None:
+                cursor.execute("INSERT INTO exercise_history "
+                               "VALUES (?,?,?,?,?,?,?)",
+                               (exercise.exercise_template_id,workout.start_time,exercise_id,workout.id,workout.title,
+                                exercise.notes,json.dumps(exercise.sets,separators=(",",":"))))
+    
+    def delete_workout_rows(self, cursor, workout_id) -> None:
+        """
+        Delete a workout along with its exercises and sets. Does not commit.
+        (The schema cascades, but foreign keys are not enforced on our connections, so the children are removed explicitly.)
+        :param cursor: The cursor to delete with.
+        :param workout_id: The workout ID, in UUID format.
+        """
+        
+        cursor.execute("DELETE FROM exercise_history WHERE workout_id = ?",(workout_id,))
+        cursor.execute("DELETE FROM sets WHERE exercise_id IN (SELECT exercise_id FROM exercises WHERE workout_id = ?)",(workout_id,))
+        cursor.execute("DELETE FROM exercises WHERE workout_id = ?",(workout_id,))
+        cursor.execute("DELETE FROM workouts WHERE id = ?",(workout_id,))
     
-    def update_workout_locally(self,workout_id, data):
+    def rebuild_exercise_history(self) -> None:
+        """
+        Recompute the exercise_history table from the exercises and sets tables (e.g. for a database made before it existed).
+        """
+        
+        conn = self.connect_database()
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM exercise_history")
+        
+        query = ("SELECT exercises.exercise_template_id, workouts.start_time, exercises.exercise_id, workouts.id, workouts.title, "
+                 "exercises.exercise_notes, sets.set_index, sets.set_type, sets.weight, sets.reps, sets.distance, sets.duration, sets.rpe "
+                 "FROM exercises "
+                 "INNER JOIN workouts ON workouts.id = exercises.workout_id "
+                 "LEFT JOIN sets ON sets.exercise_id = exercises.exercise_id "
+                 "WHERE exercises.exercise_template_id IS NOT NULL "
+                 "ORDER BY exercises.exercise_id, sets.set_index")
+        
+        rows = []
+        current = None
+        # The rows are ordered by exercise, so each exercise's sets can be collected in a single pass.
+        for row in conn.execute(query):
+            if current is None or current[2] != row[2]:
+                if current is not None:
+                    rows.append(current[:6] + (json.dumps(sets,separators=(",",":")),))
+                current = row[:6]
+                sets = []
+            if row[6] is not None:
+                sets.append(row[6:])
+        if current is not None:
+            rows.append(current[:6] + (json.dumps(sets,separators=(",",":")),))
+        
+        cursor.executemany("INSERT INTO exercise_history VALUES (?,?,?,?,?,?,?)", rows)
+        conn.commit()
+        cursor.close()
+        conn.close()
+    
+    def update_workout_locally(self,workout_id, data) -> bool:
         """
         Update the workout (if it exists) with the given data.
+        The exercises and sets of the workout are replaced with the ones in the data.
         :param: workout_id, the workout ID to update.
-        :param: data, the data to update the workout with.
+        :param: data, a WorkoutRecord to update the workout with.
+        :return: True if the workout was updated.
         """
         
         conn = self.connect_database()
@@ -380,42 +485,35 @@ class NotAnotherPullupMain:
         
         cursor.execute("SELECT * FROM workouts WHERE id = ?", (workout_id,))
         result = cursor.fetchall()
-        
+        updated = False
 
-        try:
-            if result is None:
-                print("Workout not found. There was nothing to update.")
-            else:
-                title = data["title"]
-                print("Updating workout " + title + ".")
+        if result == []:
+            print("Workout not found. There was nothing to update.")
+        else:
+            print("Updating workout " + data.title + ".")
 
-                description = data["description"]
-                start_time = data["start_time"]
-                end_time = data["end_time"]
-                updated_at = data["updated_at"]
-                created_at = data["created_at"]
-                added_on = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
-                cursor.execute("UPDATE workouts SET "
-                            "title=?,description=?,start_time=?,end_time=?,update_time=?,creation_time=?,added_on=? "
-                            "WHERE id =?",(title,description,start_time,end_time,updated_at,created_at,added_on,workout_id))
-                conn.commit()
-        except KeyError:
-            print("Data is missing. Workout was not updated.")
+            added_on = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+            self.delete_workout_rows(cursor, workout_id)
+            self.insert_workout_rows(cursor, data, added_on)
+            conn.commit()
+            updated = True
         
         cursor.close()
         conn.close()
+        return updated
             
-    def add_workout_locally(self,workout):
+    def add_workout_locally(self,workout) -> bool:
         """
         Add a workout to the database with the given data.
-        :param: workout, a dictionary with the workout data.
+        :param: workout, a WorkoutRecord with the workout data.
+        :return: True if the workout was added.
         """
         
-        id_to_search = workout["id"]
+        id_to_search = workout.id
         
         conn = self.connect_database()
         cursor = conn.cursor()
-
+        added = False
         
         cursor.execute("SELECT * FROM workouts WHERE id = ?",(id_to_search,))
         result = cursor.fetchall()
@@ -423,47 +521,85 @@ class NotAnotherPullupMain:
             print("There already exists a workout with this ID. It was not added.")
         else:
             print("Adding workout.")
-            workout_id = workout["id"]
-            title = workout["title"]
-            description = workout["description"]
-            start_time = workout["start_time"]
-            end_time = workout["end_time"]
-            updated_at = workout["updated_at"]
-            created_at = workout["created_at"]
             added_on = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
             
-            cursor.execute("INSERT INTO workouts "
-                        "VALUES (?,?,?,?,?,?,?,?)", (workout_id,title,description,start_time,end_time,updated_at,created_at,added_on))
+            self.insert_workout_rows(cursor, workout, added_on)
             
             conn.commit()
+            added = True
             print("Workout added.")
         
         cursor.close()
         conn.close()
+        return added
         
-    def delete_workout_locally(self,workout_id):
+    def import_workouts_from_file(self, path) -> list:
+        """
+        Add the workouts in a JSON file (an API page, or an exported array of workouts) that aren't in the database yet.
+        The file is parsed as it is read, so large archives don't have to fit in memory.
+        :param path: The path to the JSON file.
+        :return: The IDs of the workouts that were added.
+        """
+        
+        conn = self.connect_database()
+        cursor = conn.cursor()
+        added_on = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+        added = []
+        skipped = 0
+        invalid = 0
+        
+        with open(path, "rb") as file:
+            for workout in iter_json_items(iter_file_chunks(file), "workouts"):
+                try:
+                    workout = to_workout_record(workout)
+                except KeyError as e:
+                    print("Data is missing from a workout (" + str(e) + "). It was skipped.")
+                    invalid += 1
+                    continue
+                cursor.execute("SELECT 1 FROM workouts WHERE id = ?",(workout.id,))
+                if cursor.fetchone() is not None:
+                    skipped += 1
+                    continue
+                self.insert_workout_rows(cursor, workout, added_on)
+                added.append(workout.id)
+        conn.commit()
+        
+        print("Imported " + str(len(added)) + " workouts. " + str(skipped) + " were already in the database. "
+              + str(invalid) + " were missing data.")
+        cursor.close()
+        conn.close()
+        return added
+        
+    def delete_workout_locally(self,workout_id) -> bool:
         """
         Delete a workout in the database.
         :param: workout_id, in UUID format.
+        :return: True if the workout was deleted.
         """
         conn = self.connect_database()
         cursor = conn.cursor()
+        deleted = False
         
         cursor.execute("SELECT * FROM workouts WHERE id = ?",(workout_id,))
         results = cursor.fetchall()
-        if results is None:
+        if results == []:
             print("Workout not found. Nothing was deleted.")
         else:
             print("Deleting workout.")
-            cursor.execute("DELETE FROM workouts WHERE id = ?",(workout_id,))
+            self.delete_workout_rows(cursor, workout_id)
             conn.commit()
+            deleted = True
             print("Workout deleted.")
         cursor.close()
         conn.close()
+        return deleted
         
 class DatabaseUtilities:
-    def __init__(self, database_path=""):
+    def __init__(self, database_path="", details_cache_size=32):
         self.database_path = database_path
+        # Formatted workout details, keyed by (workout ID, update time) so edited workouts fall out naturally.
+        self.workout_details_cache = OrderedDict()
+        self.details_cache_size = details_cache_size
         try:
             if not os.path.isfile(database_path):
                 raise Exception("Database does not exist.")
@@ -502,29 +638,241 @@ class DatabaseUtilities:
         results = self.cursor.execute(query,("%" + keyword + "%",))
         return results.fetchall()
     def get_notes_by_exercise_name(self,exercise_name, descending=True):
-        query = "SELECT exercises.notes, workout.creation_date FROM exercises INNER JOIN workouts ON exercises.workout_id = workouts.id WHERE exercises.exercise_title = ? ORDER BY workouts.creation_date"
+        query = "SELECT workouts.creation_time, exercises.exercise_title, exercises.exercise_notes FROM exercises INNER JOIN workouts ON exercises.workout_id = workouts.id WHERE exercises.exercise_title = ? COLLATE NOCASE AND exercises.exercise_notes != '' ORDER BY workouts.creation_time"
 
         query += " DESC" if descending else " ASC"
-        self.cursor.execute(query, (exercise_name,))
+        results = self.cursor.execute(query, (exercise_name,))
+        return results.fetchall()
 
     def get_exercise_name_by_template_id(self,template_id):
-        query = "SELECT exercise_title FROM exercise_templates WHERE id = ?"
+        query = "SELECT exercise_title FROM exercise_templates WHERE template_id = ?"
         
         results = self.cursor.execute(query,(template_id,))
         return results.fetchone()
     
     def get_template_id_by_exercise_name(self,exercise_name):
-        query = "SELECT id FROM exercise_templates WHERE exercise_title = ?"
+        query = "SELECT template_id FROM exercise_templates WHERE exercise_title = ? COLLATE NOCASE"
         
         results = self.cursor.execute(query,(exercise_name,))
         return results.fetchone()
     
+    def get_recent_exercise_history(self, template_id, sessions=5):
+        """
+        Get the last few sessions of an exercise, most recent first, from the exercise_history table.
+        If the exercise was done more than once in a workout, those entries are merged into one session.
+        :param template_id: The exercise template ID.
+        :param sessions: How many sessions (workouts) to get.
+        :return: A list of (start time, workout title, exercise notes, list of SetRecords) tuples.
+        """
+        
+        # exercise_history has a row per exercise entry, so find where the last N distinct start times begin
+        # (a range read on the primary key), then read every entry from there on (another range read).
+        # A session is a start time, both here and when merging below, so the limit and the merge always agree.
+        query = ("SELECT start_time, workout_title, exercise_notes, sets FROM exercise_history "
+                 "WHERE exercise_template_id = ? AND start_time >= "
+                 "(SELECT MIN(start_time) FROM (SELECT DISTINCT start_time FROM exercise_history "
+                 "WHERE exercise_template_id = ? ORDER BY start_time DESC LIMIT ?)) "
+                 "ORDER BY start_time DESC, exercise_id")
+        
+        history = []
+        previous_start_time = None
+        for start_time, workout_title, notes, sets in self.cursor.execute(query, (template_id, template_id, sessions)):
+            sets = [SetRecord(*set) for set in json.loads(sets)]
+            if start_time == previous_start_time:
+                # Another entry of the same exercise at the same start time (the same workout): number its sets after the ones before it.
+                merged_start_time, merged_title, merged_notes, merged_sets = history[-1]
+                merged_sets.extend([set._replace(index=len(merged_sets) + offset) for offset, set in enumerate(sets)])
+                if notes:
+                    merged_notes = merged_notes + "\n" + notes if merged_notes else notes
+                history[-1] = (merged_start_time, merged_title, merged_notes, merged_sets)
+            else:
+                history.append((start_time, workout_title, notes, sets))
+                previous_start_time = start_time
+        return history
+    
+    def get_exercise_template_stats(self, template_id):
+        """
+        Get the stats of an exercise template, as last computed by the AnalyticsExecutor.
+        :return: A (sessions, best weight, best estimated 1RM, best set volume, volume slope per week, computed on) tuple, or None.
+        """
+        
+        query = ("SELECT sessions, best_weight, best_e1rm, best_set_volume, volume_slope, computed_on "
+                 "FROM exercise_template_stats WHERE template_id = ?")
+        
+        results = self.cursor.execute(query, (template_id,))
+        return results.fetchone()
+    
+    def get_template_ids_by_workouts(self, workout_ids):
+        """
+        Get the exercise templates used in some workouts.
+        :param workout_ids: The workout IDs, in UUID format.
+        :return: A set of exercise template IDs.
+        """
+        
+        template_ids = set()
+        for workout_id in workout_ids:
+            for row in self.cursor.execute("SELECT DISTINCT exercise_template_id FROM exercises WHERE workout_id = ?", (workout_id,)):
+                template_ids.add(row[0])
+        return template_ids
+    
+    def get_outdated_template_ids(self):
+        """
+        Get the exercise templates whose stats count a different number of sessions than exercise_history has,
+        e.g. because a workout was deleted since they were computed.
+        :return: A list of exercise template IDs.
+        """
+        
+        query = ("SELECT template_id FROM exercise_template_stats WHERE sessions != "
+                 "(SELECT COUNT(DISTINCT start_time) FROM exercise_history WHERE exercise_template_id = template_id)")
+        
+        return [row[0] for row in self.cursor.execute(query)]
+    
+    def get_missing_columns(self):
+        """
+        Check for columns that were added to existing tables after the database was created.
+        upgrade_database can only add missing tables and indexes, so a database without these columns has to be rebuilt.
+        :return: The missing columns as "table.column" strings, or an empty list if the database is up to date.
+        """
+        
+        missing_columns = []
+        for table, column in [("workouts", "added_on"), ("exercises", "exercise_template_id")]:
+            columns = [row[1] for row in self.cursor.execute("PRAGMA table_info(" + table + ")")]
+            if column not in columns:
+                missing_columns.append(table + "." + column)
+        return missing_columns
+    
+    def get_workout_count(self):
+        """
+        Get the number of workouts in the database (the account's workout count, as of the last sync).
+        """
+        return self.cursor.execute("SELECT COUNT(*) FROM workouts").fetchone()[0]
+    
     def get_all_workouts(self, descending=True):
-        query = "SELECT title,creation_time,id FROM workouts" +" ORDER BY creation_time"
+        # update_time comes along so opening a workout from this list can check the details cache without another query.
+        query = "SELECT title,creation_time,id,update_time FROM workouts" +" ORDER BY creation_time"
         query += " DESC" if descending else " ASC"
         
         results = self.cursor.execute(query)
         return results.fetchall()
+    def get_more_details_on_workout(self, workout_id):
+        """
+        Get a workout with all of its exercises and sets, the template names and the muscle groups, in one query.
+        :param workout_id: The workout ID, in UUID format.
+        :return: A nested dictionary of the workout (exercises in order, each with its sets in order), or None if it doesn't exist.
+        """
+        
+        query = ("SELECT workouts.id, workouts.title, workouts.description, workouts.start_time, workouts.end_time, workouts.update_time, "
+                 "exercises.exercise_id, exercises.exercise_index, exercises.exercise_title, exercises.exercise_notes, exercises.exercise_template_id, "
+                 "exercise_templates.exercise_title, muscle_groups.muscle_name, "
+                 "(SELECT group_concat(secondary.muscle_name, ', ') FROM secondary_muscle_groups "
+                 "INNER JOIN muscle_groups AS secondary ON secondary_muscle_groups.muscle_id = secondary.muscle_id "
+                 "WHERE secondary_muscle_groups.template_id = exercises.exercise_template_id), "
+                 "sets.set_index, sets.set_type, sets.weight, sets.reps, sets.distance, sets.duration, sets.rpe "
+                 "FROM workouts "
+                 "LEFT JOIN exercises ON exercises.workout_id = workouts.id "
+                 "LEFT JOIN exercise_templates ON exercise_templates.template_id = exercises.exercise_template_id "
+                 "LEFT JOIN muscle_groups ON muscle_groups.muscle_id = exercise_templates.primary_muscle_group_id "
+                 "LEFT JOIN sets ON sets.exercise_id = exercises.exercise_id "
+                 "WHERE workouts.id = ? "
+                 "ORDER BY exercises.exercise_index, exercises.exercise_id, sets.set_index")
+        
+        workout = None
+        current_exercise = None
+        # The rows are ordered by exercise, so the nested structure can be rebuilt in a single pass.
+        for row in self.cursor.execute(query, (workout_id,)):
+            if workout is None:
+                workout = {"id": row[0], "title": row[1], "description": row[2], "start_time": row[3],
+                           "end_time": row[4], "update_time": row[5], "exercises": []}
+            if row[6] is None:
+                # A workout without any exercises.
+                continue
+            if current_exercise is None or current_exercise["exercise_id"] != row[6]:
+                current_exercise = {"exercise_id": row[6], "index": row[7], "title": row[8], "notes": row[9],
+                                    "exercise_template_id": row[10], "template_title": row[11],
+                                    "primary_muscle_group": row[12],
+                                    "secondary_muscle_groups": row[13].split(", ") if row[13] else [],
+                                    "sets": []}
+                workout["exercises"].append(current_exercise)
+            if row[14] is not None:
+                current_exercise["sets"].append({"index": row[14], "type": row[15], "weight_kg": row[16], "reps": row[17],
+                                                 "distance_meters": row[18], "duration_seconds": row[19], "rpe": row[20]})
+        return workout
+    
+    def format_workout_details(self, workout):
+        """
+        Turn the nested workout dictionary from get_more_details_on_workout into printable text.
+        """
+        
+        lines = [workout["title"], workout["start_time"] + " to " + workout["end_time"]]
+        if workout["description"]:
+            lines.append(workout["description"])
+        
+        for exercise in workout["exercises"]:
+            header = str(exercise["index"] + 1) + ". " + str(exercise["title"])
+            if exercise["template_title"] is not None and exercise["template_title"] != exercise["title"]:
+                header += " (" + exercise["template_title"] + ")"
+            if exercise["primary_muscle_group"] is not None:
+                header += " -- " + exercise["primary_muscle_group"]
+                if exercise["secondary_muscle_groups"]:
+                    header += " (also " + ", ".join(exercise["secondary_muscle_groups"]) + ")"
+            lines.append(header)
+            if exercise["notes"]:
+                lines.append("   Notes: " + exercise["notes"])
+            
+            for set in exercise["sets"]:
+                lines.append(self.format_set(SetRecord(set["index"], set["type"], set["weight_kg"], set["reps"],
+                                                       set["distance_meters"], set["duration_seconds"], set["rpe"])))
+        return "\n".join(lines)
+    
+    def format_set(self, set):
+        """
+        Turn a SetRecord into an indented line of text, e.g. "   Set 2 (normal): 60 kg x 8 reps @ RPE 8".
+        """
+        
+        parts = []
+        if set.weight is not None:
+            parts.append(str(round(set.weight, 2)) + " kg")
+        if set.reps is not None:
+            parts.append(str(set.reps) + " reps")
+        if set.distance is not None:
+            parts.append(str(set.distance) + " m")
+        if set.duration is not None:
+            parts.append(str(set.duration) + " s")
+        line = "   Set " + str(set.index + 1) + " (" + str(set.type) + "): " + " x ".join(parts)
+        if set.rpe is not None:
+            line += " @ RPE " + str(set.rpe)
+        return line
+    
+    def get_workout_details_text(self, workout_id, update_time=None):
+        """
+        Get the formatted details of a workout, using the cache when the workout hasn't changed since it was formatted.
+        :param workout_id: The workout ID, in UUID format.
+        :param update_time: The update time of the workout, if the caller already has it. Otherwise it is looked up by primary key.
+        :return: The formatted details, or None if the workout doesn't exist.
+        """
+        
+        if update_time is None:
+            result = self.cursor.execute("SELECT update_time FROM workouts WHERE id = ?", (workout_id,)).fetchone()
+            if result is None:
+                return None
+            update_time = result[0]
+        
+        key = (workout_id, update_time)
+        if key in self.workout_details_cache:
+            self.workout_details_cache.move_to_end(key)
+            return self.workout_details_cache[key]
+        
+        workout = self.get_more_details_on_workout(workout_id)
+        if workout is None:
+            return None
+        text = self.format_workout_details(workout)
+        
+        # Key on the update time that was actually read, in case the workout changed in between.
+        self.workout_details_cache[(workout_id, workout["update_time"])] = text
+        if len(self.workout_details_cache) > self.details_cache_size:
+            self.workout_details_cache.popitem(last=False)
+        return text
+    
     def convert_kg_to_lbs(self,kg,truncate=False):
         # Most gyms only do .5 increments for pounds, so I should truncate the result if the user wants.
         if truncate:
@@ -536,6 +884,12 @@ class CLInterface:
         self.api_key = api_key
         self.client = None
         self.database_util = None
+        self.analytics = None
+        # Filled in by check_api, which runs in the background while the menus are usable.
+        self.api_check_done = threading.Event()
+        self.api_reachable = None
+        self.api_workout_count = None
+        self.api_check_reported = False
         
     def menu_printer(self,menu_options):
         menu_string = ""
@@ -551,14 +905,9 @@ class CLInterface:
         """
         
         print("Welcome to Not Another Pullup -- CLI.")
-        print("Checking if the API can be reached...")
         
-        response = requests.get("https://api.hevyapp.com/v1/workouts/count",headers={"api-key":self.api_key})
-        if response.status_code != 200:
-            print("The API could not be reached. Please check your API key, otherwise the API may be down.")
-            sys.exit(0)
-        else:
-            print("Wow, you've done " + str(response.json()["workout_count"]) + " workouts. That's impressive.") if response.json()["workout_count"] != 0 else print("You haven't done any workouts yet... Girl, you better get to work.")
+        # Only the options that need the API wait for this check, so local work can start right away.
+        threading.Thread(target=self.check_api, daemon=True).start()
         
         self.client = NotAnotherPullupMain(self.api_key)
         
@@ -567,7 +916,7 @@ class CLInterface:
             print("1. Yes")
             print("Anything else. (This will exit the application.)")
             response = input("Please select an option: ")
-            if response == "1":
+            if response == "1" and self.require_api():
                 self.client.initialize_database()
                 self.client.populate_database(self.api_key)
             else:
@@ -575,8 +924,22 @@ class CLInterface:
                 
         done = False
         
+        self.client.upgrade_database()
         self.database_util = DatabaseUtilities("database.db")
+        missing_columns = self.database_util.get_missing_columns()
+        if missing_columns != []:
+            # The exercise history can't be built without them, but the menus that only read workouts still work.
+            print("This database was created by an older version and is missing " + ", ".join(missing_columns) + ". "
+                  "Please rebuild it (in Database operations) to use the exercise history and insights.")
+        elif self.database_util.cursor.execute("SELECT NOT EXISTS (SELECT 1 FROM exercise_history) AND EXISTS (SELECT 1 FROM exercises)").fetchone()[0]:
+            print("Building the exercise history for the first time...")
+            self.client.rebuild_exercise_history()
+        
+        workout_count = self.database_util.get_workout_count()
+        print("Wow, you've done " + str(workout_count) + " workouts. That's impressive.") if workout_count != 0 else print("You haven't done any workouts yet... Girl, you better get to work.")
+        
         while not done:
+            self.report_api_check()
             print("--- Main Menu ---")
             menu_options = ["Database operations.",
                             "Get data.",
@@ -595,9 +958,59 @@ class CLInterface:
                 self.database_operations()
             elif actual_response == "Get data.":
                 self.data_gathering()
+            elif actual_response == "Calculate insights.":
+                self.insights()
             else:
                 print("I didn't code that yet.")
     
+    def check_api(self):
+        """
+        Check if the API can be reached with the API key, and get the workout count on the account.
+        Meant to be run in a background thread; require_api waits for it.
+        """
+        import requests
+        
+        try:
+            response = requests.get("https://api.hevyapp.com/v1/workouts/count",headers={"api-key":self.api_key},timeout=10)
+            self.api_reachable = response.status_code == 200
+            if self.api_reachable:
+                self.api_workout_count = response.json()["workout_count"]
+        except requests.RequestException:
+            self.api_reachable = False
+        except (KeyError, ValueError):
+            # The API answered, but not with a workout count we can read. Leave the count unset.
+            logging.debug("The workouts/count response did not contain a workout count.")
+        finally:
+            self.api_check_done.set()
+    
+    def report_api_check(self):
+        """
+        Once the background API check is done, tell the user (once) if the API can't be reached or the database is behind.
+        """
+        if self.api_check_reported or not self.api_check_done.is_set():
+            return
+        self.api_check_reported = True
+        
+        if not self.api_reachable:
+            print("The API could not be reached. You can still use the local database, but you can't sync it.")
+        elif self.api_workout_count is not None and self.api_workout_count != self.database_util.get_workout_count():
+            print("Your account has " + str(self.api_workout_count) + " workouts, but the local database has "
+                  + str(self.database_util.get_workout_count()) + ". You may want to update the database.")
+    
+    def require_api(self):
+        """
+        Wait for the background API check to finish.
+        :return: True if the API can be reached, otherwise False (after telling the user).
+        """
+        if not self.api_check_done.is_set():
+            print("Checking if the API can be reached...")
+            self.api_check_done.wait()
+        
+        if not self.api_reachable:
+            print("The API could not be reached. Please check your API key, otherwise the API may be down.")
+            return False
+        return True
+    
     def database_operations(self):
         """
         The database operations menu.
@@ -605,6 +1018,8 @@ class CLInterface:
         done = False
         while not done:
             menu_options = ["Update database.",
+                            "Start auto-sync.",
+                            "Import workouts from file.",
                             "Rebuild database.",
                             "Backup database.",
                             "Go back to main menu."]
@@ -616,9 +1031,28 @@ class CLInterface:
             
             if actual_response == "Go back to main menu.":
                 done = True
+            elif actual_response in ["Update database.", "Start auto-sync.", "Rebuild database."] and not self.require_api():
+                pass
             elif actual_response == "Update database.":
                 print("Updating database...")
-                self.client.update_database()
+                changes = self.client.update_database()
+                analytics = self.get_analytics()
+                if analytics is not None:
+                    analytics.on_sync(changes)
+                self.refresh_exercise_stats(changes)
+            elif actual_response == "Start auto-sync.":
+                self.start_auto_sync()
+            elif actual_response == "Import workouts from file.":
+                path = input("Please input the path to the JSON file: ")
+                try:
+                    added = self.client.import_workouts_from_file(path)
+                except (OSError, ValueError, KeyError) as e:
+                    print("The file could not be imported: " + str(e))
+                else:
+                    analytics = self.get_analytics()
+                    if analytics is not None:
+                        analytics.refresh_workouts(added)
+                    self.refresh_exercise_stats({"added":added,"updated":[],"deleted":[]})
             elif actual_response == "Rebuild database.":
                 print("This process will remove the current database and rebuild it. Are you sure you want to continue?")
                 self.menu_printer(["Yes.","No."])
@@ -629,7 +1063,14 @@ class CLInterface:
                     actual_response = "No."
     
                 if actual_response == "Yes.":
+                    # The rebuild deletes database.db, so let go of the connections to the old file first.
+                    self.database_util.conn.close()
+                    if self.analytics is not None:
+                        self.analytics.conn.close()
+                        self.analytics = None
                     self.client.initiate_rebuild()
+                    self.database_util = DatabaseUtilities("database.db")
+                    self.get_analytics()
                 elif actual_response == "No.":
                     pass
             elif actual_response == "Backup database.":
@@ -647,6 +1088,147 @@ class CLInterface:
                     self.client.backup_database()
                 elif actual_response == "No.":
                     pass
+
+    def get_analytics(self):
+        """
+        Get the muscle group analytics for the local database, building the rollups the first time they are needed.
+        :return: The MuscleGroupAnalytics, or None if the database is too old for them (after telling the user).
+        """
+        if self.analytics is None:
+            from analytics import MuscleGroupAnalytics
+            
+            missing_columns = self.database_util.get_missing_columns()
+            if missing_columns != []:
+                print("The database is missing " + ", ".join(missing_columns) + ", so the muscle group analytics are unavailable. "
+                      "Please rebuild the database to use them.")
+                return None
+            
+            self.analytics = MuscleGroupAnalytics("database.db")
+            if self.analytics.cursor.execute("SELECT COUNT(*) FROM muscle_group_rollups").fetchone()[0] == 0:
+                print("Computing muscle group training load for the first time...")
+                self.analytics.rebuild()
+        return self.analytics
+    
+    def insights(self):
+        """
+        The insights menu.
+        """
+        done = False
+        while not done:
+            menu_options = ["Muscle group training load.",
+                            "Exercise progress.",
+                            "Recompute exercise stats.",
+                            "Go back to main menu."]
+            self.menu_printer(menu_options)
+            
+            response = input("Please select an option: ")
+            actual_response = menu_options[int(response)-1]
+            
+            if actual_response == "Go back to main menu.":
+                done = True
+            elif actual_response == "Recompute exercise stats.":
+                self.recompute_exercise_stats()
+            elif actual_response == "Exercise progress.":
+                exercise_name = input("Please input the exercise name: ")
+                template_id = self.database_util.get_template_id_by_exercise_name(exercise_name)
+                if template_id is None:
+                    print("I cannot find an exercise called " + exercise_name + ".")
+                    continue
+                
+                stats = self.database_util.get_exercise_template_stats(template_id[0])
+                if stats is None:
+                    # Only this exercise is missing, so there is no need to recompute all of them.
+                    self.recompute_exercise_stats([template_id[0]])
+                    stats = self.database_util.get_exercise_template_stats(template_id[0])
+                if stats is None or stats[0] == 0:
+                    print("There are no sessions recorded for this exercise.")
+                    continue
+                
+                sessions, best_weight, best_e1rm, best_set_volume, volume_slope, computed_on = stats
+                print(exercise_name + ": " + str(sessions) + " sessions (as of " + computed_on + ").")
+                if best_weight is not None:
+                    print("Heaviest weight: " + str(round(best_weight, 2)) + " kg.")
+                if best_e1rm is not None:
+                    print("Best estimated 1RM: " + str(round(best_e1rm, 2)) + " kg.")
+                    print("Best set volume: " + str(round(best_set_volume, 2)) + " kg.")
+                if volume_slope is not None:
+                    print("Volume trend: " + ("+" if volume_slope >= 0 else "") + str(round(volume_slope, 1)) + " kg per week. "
+                          + ("Progressive overload is happening." if volume_slope > 0 else "Volume isn't going up."))
+            elif actual_response == "Muscle group training load.":
+                analytics = self.get_analytics()
+                if analytics is None:
+                    continue
+                muscle_name = input("Please input the muscle group (e.g. lats): ")
+                self.menu_printer(["Weekly.","Monthly."])
+                try:
+                    response = input("Please select an option: ")
+                    bucket_type = ["week","month"][int(response)-1]
+                    periods = int(input("How many " + bucket_type + "s do you want to look back? "))
+                    load = analytics.get_muscle_group_load(muscle_name, periods, bucket_type)
+                except (IndexError, ValueError):
+                    print("This is not a valid number.")
+                except Exception as e:
+                    print(e)
+                else:
+                    if load == []:
+                        print("You haven't trained " + muscle_name + " in that time.")
+                    for bucket_start, sets, volume in load:
+                        print(bucket_type.capitalize() + " of " + bucket_start + ": " + str(round(sets, 1)) + " sets, " + str(round(volume)) + " kg volume.")
+                    if load != []:
+                        print("Total: " + str(round(sum(row[1] for row in load), 1)) + " sets, " + str(round(sum(row[2] for row in load))) + " kg volume.")
+    
+    def recompute_exercise_stats(self, template_ids=None):
+        """
+        Recompute the stats of exercise templates, in parallel.
+        :param template_ids: The templates to recompute, or None for all of them.
+        """
+        from analytics import AnalyticsExecutor, compute_template_stats
+        
+        print("Computing exercise stats...")
+        # A single template isn't worth starting a process pool for.
+        workers = 1 if template_ids is not None and len(template_ids) == 1 else None
+        count = AnalyticsExecutor("database.db", workers).run(compute_template_stats, "exercise_template_stats", template_ids)
+        print("Computed the stats of " + str(count) + " exercises.")
+    
+    def refresh_exercise_stats(self, changes):
+        """
+        Recompute the stats of the exercises in the workouts that changed in a sync or an import.
+        Deleted workouts are already gone from the database, so their exercises are found by their stats being outdated.
+        :param changes: The workout IDs that were added, updated and deleted.
+        """
+        if self.database_util.get_missing_columns() != []:
+            return
+        
+        template_ids = self.database_util.get_template_ids_by_workouts(changes["added"] + changes["updated"])
+        if changes["deleted"] != []:
+            template_ids.update(self.database_util.get_outdated_template_ids())
+        if template_ids:
+            self.recompute_exercise_stats(sorted(template_ids))
+    
+    def start_auto_sync(self):
+        """
+        Keep the database in sync with the account until the user presses Ctrl+C.
+        """
+        import asyncio
+        from autosync import AutoSyncDaemon
+        
+        daemon = AutoSyncDaemon(self.client)
+        analytics = self.get_analytics()
+        if analytics is not None:
+            daemon.subscribe(analytics.on_sync)
+        daemon.subscribe(self.refresh_exercise_stats)
+        
+        @daemon.subscribe
+        def print_changes(changes):
+            print("Synced " + str(len(changes["added"])) + " new, " + str(len(changes["updated"])) + " updated and "
+                  + str(len(changes["deleted"])) + " deleted workouts.")
+        
+        print("Auto-sync is running. Press Ctrl+C to go back.")
+        try:
+            asyncio.run(daemon.run())
+        except KeyboardInterrupt:
+            print("Auto-sync stopped.")
+    
     def data_gathering(self):
         done = False
         while not done:
@@ -654,6 +1236,7 @@ class CLInterface:
                             "Get all workout notes.",
                             "Get all exercises.",
                             "Get all exercise notes.",
+                            "Get last sessions of an exercise.",
                             "Get all exercise templates.",
                             "Get all muscle groups.",
                             "Go back to main menu."]
@@ -683,7 +1266,7 @@ class CLInterface:
                     print("Page " + str(current_page) + "/" + str(total_pages))
                     page = workouts[start_range:end_range]
                     
-                    self.menu_printer(page)
+                    self.menu_printer([workout[:3] for workout in page])
                     menu_options = ["Open workout.",
                                     "Next page.",
                                     "Previous page.",
@@ -732,7 +1315,31 @@ class CLInterface:
                             except ValueError:
                                 print("Not a valid number.")
                             else:
-                                self.database_options.get_more_details_on_workout(workout[0])
+                                if self.database_util.get_missing_columns() != []:
+                                    print("This database is too old to show workout details. Please rebuild it first.")
+                                    continue
+                                details = self.database_util.get_workout_details_text(workout[2], workout[3])
+                                print(details if details is not None else "This workout no longer exists.")
+            elif actual_response == "Get last sessions of an exercise.":
+                exercise_name = input("Please input the exercise name: ")
+                template_id = self.database_util.get_template_id_by_exercise_name(exercise_name)
+                if template_id is None:
+                    print("I cannot find an exercise called " + exercise_name + ".")
+                    continue
+                try:
+                    sessions = int(input("How many sessions do you want to see? "))
+                    # SQLite treats a negative LIMIT as no limit at all.
+                    assert sessions > 0
+                except (ValueError, AssertionError):
+                    print("This is not a valid number.")
+                    continue
+                
+                for start_time, workout_title, notes, sets in self.database_util.get_recent_exercise_history(template_id[0], sessions):
+                    print(start_time + " -- " + workout_title)
+                    if notes:
+                        print("   Notes: " + notes)
+                    for set in sets:
+                        print(self.database_util.format_set(set))
             elif actual_response == "Get all workout notes.":
                 perusing = True
                 while perusing:
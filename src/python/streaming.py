@@ -0,0 +1,176 @@
+import json
+import codecs
+from collections import namedtuple
+
+# Compact, flat records for the ingest path, in the same column order as the tables in schema.sql.
+# A WorkoutRecord holds a tuple of ExerciseRecords, which each hold a tuple of SetRecords.
+WorkoutRecord = namedtuple("WorkoutRecord", ["id", "title", "description", "start_time", "end_time",
+                                             "update_time", "creation_time", "exercises"])
+ExerciseRecord = namedtuple("ExerciseRecord", ["index", "title", "notes", "exercise_template_id", "sets"])
+SetRecord = namedtuple("SetRecord", ["index", "type", "weight", "reps", "distance", "duration", "rpe"])
+
+# How much of a response body or file to read at a time.
+CHUNK_SIZE = 64 * 1024
+
+
+def to_workout_record(workout) -> WorkoutRecord:
+    """
+    Turn a workout dictionary, as returned by the Hevy API, into a WorkoutRecord.
+    :raises: KeyError if the workout is missing any data.
+    """
+    return WorkoutRecord(workout["id"], workout["title"], workout["description"], workout["start_time"],
+                         workout["end_time"], workout["updated_at"], workout["created_at"],
+                         tuple(ExerciseRecord(exercise["index"], exercise["title"], exercise["notes"],
+                                              exercise["exercise_template_id"],
+                                              tuple(SetRecord(set["index"], set["type"], set["weight_kg"], set["reps"],
+                                                              set["distance_meters"], set["duration_seconds"], set["rpe"])
+                                                    for set in exercise["sets"]))
+                               for exercise in workout["exercises"]))
+
+
+class JSONStreamReader:
+    """
+    Reads JSON values one at a time from an iterable of chunks (str or UTF-8 bytes), so only the value
+    being decoded is ever held in memory, not the whole document.
+    """
+
+    def __init__(self, chunks) -> None:
+        self.chunks = iter(chunks)
+        self.decoder = json.JSONDecoder()
+        self.utf8_decoder = codecs.getincrementaldecoder("utf-8")()
+        self.buffer = ""
+        self.position = 0
+        self.exhausted = False
+
+    def read_more(self) -> bool:
+        """
+        Append the next chunk to the buffer, dropping what has already been parsed.
+        :return: False if there was nothing left to read.
+        """
+        if self.exhausted:
+            return False
+        try:
+            chunk = next(self.chunks)
+        except StopIteration:
+            self.exhausted = True
+            chunk = self.utf8_decoder.decode(b"", final=True)
+        else:
+            if isinstance(chunk, bytes):
+                chunk = self.utf8_decoder.decode(chunk)
+        self.buffer = self.buffer[self.position:] + chunk
+        self.position = 0
+        return True
+
+    def peek(self) -> str:
+        """
+        Skip whitespace and return the next character without consuming it, or "" at the end of the stream.
+        """
+        while True:
+            while self.position < len(self.buffer) and self.buffer[self.position] in " \t\r\n":
+                self.position += 1
+            if self.position < len(self.buffer):
+                return self.buffer[self.position]
+            if not self.read_more():
+                return ""
+
+    def expect(self, characters) -> str:
+        """
+        Consume the next character, which must be one of the given characters.
+        :raises: ValueError if it isn't.
+        """
+        character = self.peek()
+        if character == "" or character not in characters:
+            raise ValueError("Expected one of " + repr(characters) + " in the JSON stream, but found " + repr(character) + ".")
+        self.position += 1
+        return character
+
+    def read_value(self):
+        """
+        Decode the next complete JSON value, reading more chunks until it is complete.
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.position)
+            except json.JSONDecodeError:
+                if not self.read_more():
+                    raise
+                continue
+            # A number cut off by the end of the buffer (e.g. "1" of "1.5") decodes fine, so only accept a value
+            # once the character after it is one that can actually follow a value.
+            if (end == len(self.buffer) or self.buffer[end] not in " \t\r\n,:]}") and not self.exhausted:
+                self.read_more()
+                continue
+            self.position = end
+            return value
+
+    def iter_array(self):
+        """
+        Yield the values of the array that starts at the current position, one at a time.
+        """
+        self.expect("[")
+        if self.peek() == "]":
+            self.position += 1
+            return
+        while True:
+            yield self.read_value()
+            if self.expect(",]") == "]":
+                return
+
+    def iter_object(self, array_key, fields):
+        """
+        Walk the object that starts at the current position, yielding the values of its array_key array one at a time.
+        Every other member is decoded whole and stored in fields.
+        """
+        self.expect("{")
+        if self.peek() == "}":
+            self.position += 1
+            return
+        while True:
+            key = self.read_value()
+            self.expect(":")
+            if key == array_key and self.peek() == "[":
+                yield from self.iter_array()
+            else:
+                fields[key] = self.read_value()
+            if self.expect(",}") == "}":
+                return
+
+
+def iter_json_items(chunks, array_key, fields=None):
+    """
+    Yield the items of a JSON array one at a time from a stream of chunks.
+    The document can either be the array itself, or an object with the array under array_key
+    (like a page from the API: {"page": 1, "page_count": 70, "workouts": [...]}).
+    :param chunks: An iterable of str or bytes chunks, e.g. response.iter_content() or a file read in blocks.
+    :param array_key: The key of the array, if the document is an object.
+    :param fields: An optional dictionary to fill with the object's other top-level members (e.g. page_count).
+    """
+    if fields is None:
+        fields = {}
+    reader = JSONStreamReader(chunks)
+    if reader.peek() == "[":
+        yield from reader.iter_array()
+    else:
+        yield from reader.iter_object(array_key, fields)
+
+
+def iter_file_chunks(file, chunk_size=CHUNK_SIZE):
+    """
+    Read an open file in fixed-size chunks.
+    """
+    while True:
+        chunk = file.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+
+def iter_workout_records(chunks, fields=None):
+    """
+    Yield WorkoutRecords one at a time from a stream containing workouts (an API page or an exported archive).
+    :param chunks: An iterable of str or bytes chunks.
+    :param fields: An optional dictionary to fill with the other top-level members (e.g. page_count).
+    """
+    for workout in iter_json_items(chunks, "workouts", fields):
+        yield to_workout_record(workout)
@@ -0,0 +1,68 @@
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+import pytest
+
+import main
+
+# Startup latency budgets, in seconds. They are generous so slow machines pass, but a blocking
+# network call or a heavy import at startup blows straight through them.
+IMPORT_BUDGET = 1.0
+FIRST_PROMPT_BUDGET = 0.5
+
+# How long the stubbed API check takes. Longer than FIRST_PROMPT_BUDGET, so the first prompt can
+# only make the budget if it doesn't wait for the check.
+SLOW_API_CHECK = 2.0
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+class StopMenu(Exception):
+    pass
+
+
+def test_import_is_fast_and_does_not_load_requests():
+    script = ("import sys, time, json\n"
+              "start = time.perf_counter()\n"
+              "import main\n"
+              "print(json.dumps({'seconds': time.perf_counter() - start, 'requests': 'requests' in sys.modules}))\n")
+    result = subprocess.run([sys.executable, "-c", script], cwd=HERE, capture_output=True, text=True, check=True)
+    measured = json.loads(result.stdout.strip().splitlines()[-1])
+
+    assert not measured["requests"], "Importing main should not import requests."
+    assert measured["seconds"] < IMPORT_BUDGET
+
+
+def test_first_prompt_does_not_wait_for_the_api(tmp_path, monkeypatch):
+    # main.py expects to run from src/python, next to database.db and below schema.sql.
+    shutil.copy(os.path.join(HERE, "..", "schema.sql"), tmp_path / "schema.sql")
+    working_directory = tmp_path / "python"
+    working_directory.mkdir()
+    monkeypatch.chdir(working_directory)
+    main.NotAnotherPullupMain("key").initialize_database()
+
+    def slow_check_api(self):
+        time.sleep(SLOW_API_CHECK)
+        self.api_reachable = True
+        self.api_workout_count = 0
+        self.api_check_done.set()
+
+    prompts = []
+
+    def fake_input(prompt):
+        prompts.append(time.perf_counter())
+        raise StopMenu()
+
+    monkeypatch.setattr(main.CLInterface, "check_api", slow_check_api)
+    monkeypatch.setattr("builtins.input", fake_input)
+
+    start = time.perf_counter()
+    with pytest.raises(StopMenu):
+        main.CLInterface("key").main_menu()
+
+    assert len(prompts) == 1
+    assert prompts[0] - start < FIRST_PROMPT_BUDGET
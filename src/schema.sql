@@ -12,7 +12,7 @@ PRAGMA foreign_keys = ON;
 */
 
 
-CREATE TABLE workouts (
+CREATE TABLE IF NOT EXISTS workouts (
     id TEXT PRIMARY KEY,
     title TEXT NOT NULL,
     description TEXT DEFAULT '',
@@ -23,7 +23,7 @@ CREATE TABLE workouts (
     added_on TEXT NOT NULL
 );
 
-CREATE TABLE exercises (
+CREATE TABLE IF NOT EXISTS exercises (
     workout_id TEXT,
     exercise_id INTEGER PRIMARY KEY,
     exercise_index INTEGER NOT NULL,
@@ -33,7 +33,7 @@ CREATE TABLE exercises (
     FOREIGN KEY (workout_id) REFERENCES workouts(id) ON DELETE CASCADE,
     FOREIGN KEY (exercise_template_id) REFERENCES exercise_templates(template_id) ON DELETE CASCADE
 );
-CREATE TABLE sets (
+CREATE TABLE IF NOT EXISTS sets (
     exercise_id INTEGER NOT NULL,
     set_id INTEGER PRIMARY KEY,
     set_index INTEGER NOT NULL,
@@ -46,7 +46,11 @@ CREATE TABLE sets (
     FOREIGN KEY (exercise_id) REFERENCES exercises(exercise_id) ON DELETE CASCADE
 );
 
-CREATE TABLE exercise_templates(
+-- Used to fetch a whole workout (exercises, then their sets) in one query.
+CREATE INDEX IF NOT EXISTS exercises_by_workout ON exercises(workout_id, exercise_index);
+CREATE INDEX IF NOT EXISTS sets_by_exercise ON sets(exercise_id, set_index);
+
+CREATE TABLE IF NOT EXISTS exercise_templates(
     template_id TEXT PRIMARY KEY,
     exercise_title TEXT NOT NULL,
     type TEXT NOT NULL,
@@ -55,12 +59,12 @@ CREATE TABLE exercise_templates(
     FOREIGN KEY (primary_muscle_group_id) REFERENCES muscle_groups(muscle_id) ON DELETE CASCADE
 );
 
-CREATE TABLE muscle_groups(
+CREATE TABLE IF NOT EXISTS muscle_groups(
     muscle_id INTEGER PRIMARY KEY,
     muscle_name TEXT NOT NULL
 );
 
-CREATE TABLE secondary_muscle_groups(
+CREATE TABLE IF NOT EXISTS secondary_muscle_groups(
     template_id TEXT NOT NULL,
     muscle_id INTEGER NOT NULL,
     PRIMARY KEY (template_id, muscle_id),
@@ -68,3 +72,75 @@ CREATE TABLE secondary_muscle_groups(
     FOREIGN KEY (muscle_id) REFERENCES muscle_groups(muscle_id) ON DELETE CASCADE
 );
 
+
+/*
+    Muscle group training load, precomputed so that lookups over a time range are a primary key range read.
+
+    workout_muscle_load holds what each workout contributed to each muscle group.
+    A set counts fully towards the primary muscle group of its exercise template and partially towards each
+    secondary muscle group. Warmup sets are not counted. Volume is weight (kg) times reps.
+
+    muscle_group_rollups is the sum of workout_muscle_load per muscle group and calendar bucket.
+    bucket_type is either 'week' (starting on Monday) or 'month', and bucket_start is the first day (YYYY-MM-DD, UTC).
+*/
+
+CREATE TABLE IF NOT EXISTS workout_muscle_load(
+    workout_id TEXT NOT NULL,
+    muscle_id INTEGER NOT NULL,
+    week_start TEXT NOT NULL,
+    month_start TEXT NOT NULL,
+    sets REAL NOT NULL,
+    volume REAL NOT NULL,
+    PRIMARY KEY (workout_id, muscle_id)
+);
+
+CREATE INDEX IF NOT EXISTS workout_muscle_load_by_week ON workout_muscle_load(week_start, muscle_id);
+CREATE INDEX IF NOT EXISTS workout_muscle_load_by_month ON workout_muscle_load(month_start, muscle_id);
+
+CREATE TABLE IF NOT EXISTS muscle_group_rollups(
+    muscle_id INTEGER NOT NULL,
+    bucket_type TEXT NOT NULL,
+    bucket_start TEXT NOT NULL,
+    sets REAL NOT NULL,
+    volume REAL NOT NULL,
+    PRIMARY KEY (muscle_id, bucket_type, bucket_start),
+    FOREIGN KEY (muscle_id) REFERENCES muscle_groups(muscle_id) ON DELETE CASCADE
+) WITHOUT ROWID;
+
+/*
+    The sets of every exercise entry, keyed by exercise template, workout start time and exercise ID, so that the
+    last few sessions of an exercise are a range read on the primary key (no joins). An exercise done twice in
+    one workout has two rows with the same start time, which readers merge into one session.
+    It is kept up to date whenever workouts are added, updated or deleted.
+
+    sets is a JSON array of [set_index, set_type, weight, reps, distance, duration, rpe] arrays, in set order.
+*/
+
+CREATE TABLE IF NOT EXISTS exercise_history(
+    exercise_template_id TEXT NOT NULL,
+    start_time TEXT NOT NULL,
+    exercise_id INTEGER NOT NULL,
+    workout_id TEXT NOT NULL,
+    workout_title TEXT NOT NULL,
+    exercise_notes TEXT DEFAULT '',
+    sets TEXT NOT NULL,
+    PRIMARY KEY (exercise_template_id, start_time, exercise_id)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS exercise_history_by_workout ON exercise_history(workout_id);
+
+/*
+    Per exercise template statistics, recomputed by the AnalyticsExecutor in analytics.py.
+    Warmup sets are not counted. best_e1rm is the best estimated one rep max (Epley formula).
+    volume_slope is the linear regression slope of session volume (weight times reps) over time, in kg per week.
+*/
+
+CREATE TABLE IF NOT EXISTS exercise_template_stats(
+    template_id TEXT PRIMARY KEY,
+    sessions INTEGER NOT NULL,
+    best_weight REAL,
+    best_e1rm REAL,
+    best_set_volume REAL,
+    volume_slope REAL,
+    computed_on TEXT NOT NULL
+);